@@ -0,0 +1,12 @@
+"""Gunicorn config for the label scanner backend."""
+
+import os
+
+# Render (and most PaaS hosts) inject the listen port via $PORT
+bind = '0.0.0.0:' + os.environ.get('PORT', '5000')
+workers = os.cpu_count() or 2
+threads = 4
+worker_class = 'gthread'
+# Load the app (and run init_db) once in the master before forking;
+# each worker then opens its own SQLite connections via the thread-local pool
+preload_app = True
@@ -4,21 +4,183 @@ Uses SQLite3 for user management
 """
 
 from flask import Flask, request, jsonify, send_from_directory, session
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 import sqlite3
 import hashlib
+import hmac
 import os
+import atexit
+import threading
 import csv
 import io
+import time
+import orjson
 import requests
-from functools import wraps
-from datetime import datetime
+from functools import lru_cache, wraps
+from datetime import datetime, timedelta
 from flask import Response
 
 app = Flask(__name__, static_folder='.')
 app.secret_key = 'label-scanner-secret-key-2026'  # Fixed key for session persistence
+# Let browsers cache static assets for an hour; send_from_directory already
+# answers revalidations with 304s off the ETag/mtime, so most asset hits
+# never read the file
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 3600
 CORS(app)
 
+# Date formats the scanners actually produce, most common first
+_EXPIRY_FORMATS = ['%d/%m/%y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y', '%m/%d/%y']
+
+@lru_cache(maxsize=4096)
+def parse_expiry(expiry_str):
+    """Parse an expiry date string in any of the known formats (or None).
+
+    The string's shape (separator and year width) picks a single format up
+    front so the common case costs one strptime and zero exceptions; only
+    odd shapes fall back to trying every format. Results are memoized since
+    the same date strings recur across a batch.
+    """
+    if not expiry_str or not isinstance(expiry_str, str):
+        return None
+
+    fmt = None
+    if '/' in expiry_str:
+        fmt = '%d/%m/%y' if len(expiry_str.rsplit('/', 1)[-1]) == 2 else '%d/%m/%Y'
+    elif '-' in expiry_str:
+        fmt = '%Y-%m-%d' if len(expiry_str.split('-', 1)[0]) == 4 else '%d-%m-%Y'
+    if fmt:
+        try:
+            return datetime.strptime(expiry_str, fmt).date()
+        except ValueError:
+            pass
+
+    for fmt in _EXPIRY_FORMATS:
+        try:
+            return datetime.strptime(expiry_str, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def expiry_to_iso(expiry_str):
+    """Normalized ISO form of an expiry date, for SQL-side comparisons"""
+    parsed = parse_expiry(expiry_str)
+    return parsed.isoformat() if parsed else None
+
+def normalize_scan(scan):
+    """Pull a sync scan's fields out of the payload dict in one pass.
+
+    Returns a tuple (timestamp, batch_no, mfg_date, expiry_date, flavour,
+    rack_no, shelf_no, movement, client_uuid) with everything coerced to
+    str, or None if the entry isn't a JSON object — so malformed payloads
+    get a clean 400 instead of a TypeError inside the SQLite bindings,
+    and the handler stops re-doing dict lookups per field use.
+    """
+    if not isinstance(scan, dict):
+        return None
+    client_uuid = scan.get('clientUuid')
+    return (
+        str(scan.get('timestamp') or ''),
+        str(scan.get('batchNo') or ''),
+        str(scan.get('mfgDate') or ''),
+        str(scan.get('expiryDate') or ''),
+        str(scan.get('flavour') or ''),
+        str(scan.get('rackNo') or ''),
+        str(scan.get('shelfNo') or ''),
+        str(scan.get('movement') or 'IN'),
+        str(client_uuid) if client_uuid is not None else None,
+    )
+
+def _json_default(obj):
+    # Lets handlers pass sqlite3.Row objects (or fetchall() lists) straight
+    # to orjson without materializing dicts first
+    if isinstance(obj, sqlite3.Row):
+        return dict(obj)
+    raise TypeError
+
+def jout(data, status=200):
+    """JSON response encoded with orjson (C encoder, writes bytes directly)"""
+    return Response(orjson.dumps(data, default=_json_default),
+                    status=status, mimetype='application/json')
+
+class OrjsonProvider(JSONProvider):
+    """Route Flask's own jsonify/get_json through orjson as well"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_json_default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = OrjsonProvider(app)
+
+# Short-TTL cache of prebuilt JSON bodies for the endpoints the admin UI
+# polls. A hit skips all SQL and serialization; any scan/branch write clears
+# the whole cache, and the TTL bounds staleness for writes from other workers.
+_RESP_TTL = 5  # seconds
+_resp_cache = {}
+_resp_cache_lock = threading.Lock()
+
+def cached_json(key):
+    """Return the cached Response for key, or None if missing/expired"""
+    now = time.monotonic()
+    with _resp_cache_lock:
+        hit = _resp_cache.get(key)
+        if hit is not None and now - hit[1] >= _RESP_TTL:
+            # Evict on expiry so dead entries don't outlive their window
+            del _resp_cache[key]
+            hit = None
+    if hit is not None:
+        return Response(hit[0], mimetype='application/json')
+    return None
+
+def cache_json(key, response):
+    """Store a response body under key and return the response unchanged"""
+    now = time.monotonic()
+    with _resp_cache_lock:
+        # Sweep anything already expired; the key space is a handful of
+        # normalized endpoint/parameter tuples, so this stays tiny
+        for stale in [k for k, v in _resp_cache.items() if now - v[1] >= _RESP_TTL]:
+            del _resp_cache[stale]
+        _resp_cache[key] = (response.get_data(), now)
+    return response
+
+def invalidate_json_cache():
+    with _resp_cache_lock:
+        _resp_cache.clear()
+
+# User records change orders of magnitude less often than the requests that
+# resolve them, so id -> (username, branch_id) is kept in-process; the
+# user-mutating endpoints clear it.
+_user_info_cache = {}
+
+def get_user_info(cursor, user_id):
+    """Resolve a user id to (username, branch_id), cached per process."""
+    info = _user_info_cache.get(user_id)
+    if info is None:
+        cursor.execute('SELECT username, branch_id FROM users WHERE id = ?', (user_id,))
+        row = cursor.fetchone()
+        info = (row['username'], row['branch_id']) if row else ('Unknown', None)
+        _user_info_cache[user_id] = info
+    return info
+
+def invalidate_user_cache():
+    _user_info_cache.clear()
+
+# /api/branches is hit on every registration page load but only changes via
+# the superadmin branches endpoint, so keep the response body prebuilt as
+# bytes. The write-path rebuild only reaches the worker that handled the
+# POST, so other workers refresh their copy once it is older than the
+# response TTL rather than serving it until restart.
+_branches_bytes = None
+_branches_built = 0.0
+
+def _rebuild_branches_cache(cursor):
+    global _branches_bytes, _branches_built
+    cursor.execute('SELECT id, name, code FROM branches ORDER BY name')
+    _branches_bytes = orjson.dumps({'branches': cursor.fetchall()},
+                                   default=_json_default)
+    _branches_built = time.monotonic()
+
 # --- Authentication Decorators ---
 
 def login_required(f):
@@ -52,18 +214,268 @@ def superadmin_required(f):
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'users.db')
 
+# Shared scan INSERT, defined once so every write path hits the same prepared
+# statement in the connection's statement cache
+SCAN_INSERT_SQL = '''
+    INSERT OR IGNORE INTO scans (timestamp, batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no, movement, synced_by, branch_id, client_uuid, expiry_iso)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Bulk variant: packing several rows into one INSERT ... VALUES (...),(...)
+# statement halves the VDBE invocations per row versus executemany. 64 rows
+# at 12 columns stays well under SQLite's 999 bound-parameter limit.
+_BULK_ROWS_PER_STMT = 64
+
+def bulk_insert(cursor, insert_sql, rows):
+    """Run a single-row INSERT template against rows in multi-row chunks.
+
+    insert_sql must end with a single parenthesized placeholder group, e.g.
+    SCAN_INSERT_SQL; chunks reuse at most two statement shapes (full chunk
+    and final partial chunk), so the statement cache still hits.
+    """
+    head, _, placeholder = insert_sql.rstrip().rpartition('VALUES ')
+    for start in range(0, len(rows), _BULK_ROWS_PER_STMT):
+        chunk = rows[start:start + _BULK_ROWS_PER_STMT]
+        sql = head + 'VALUES ' + ','.join([placeholder] * len(chunk))
+        cursor.execute(sql, [value for row in chunk for value in row])
+
+# Dashboard/analytics queries as fixed texts with a null-tolerant branch
+# filter: '?1 IS NULL OR branch_id = ?1' keeps one canonical SQL string
+# whether or not a branch is selected, so sqlite3's per-connection prepared
+# statement cache always hits instead of re-parsing with/without-WHERE
+# variants built by string concatenation.
+Q_DASH_STATS = '''
+    SELECT COUNT(*),
+           SUM(CASE WHEN movement = 'IN' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN movement = 'OUT' THEN 1 ELSE 0 END)
+    FROM scans
+    WHERE (?1 IS NULL OR branch_id = ?1)
+'''
+
+# Rack counts come from the trigger-maintained scans_summary table, so the
+# cost is a handful of rows per branch rather than a scan of the whole table.
+# The fixed Rack 1-10 list lives in a VALUES CTE so empty racks come back as
+# zero rows in display order without a Python backfill loop.
+Q_DASH_RACKS = '''
+    WITH rack_names(ord, name) AS (
+        VALUES (1, 'Rack 1'), (2, 'Rack 2'), (3, 'Rack 3'), (4, 'Rack 4'), (5, 'Rack 5'),
+               (6, 'Rack 6'), (7, 'Rack 7'), (8, 'Rack 8'), (9, 'Rack 9'), (10, 'Rack 10')
+    )
+    SELECT r.name as name,
+           COALESCE(a.in_count, 0) as in_count,
+           COALESCE(a.out_count, 0) as out_count,
+           MAX(COALESCE(a.in_count - a.out_count, 0), 0) as count
+    FROM rack_names r
+    LEFT JOIN (
+        SELECT rack_no, SUM(in_count) as in_count, SUM(out_count) as out_count
+        FROM scans_summary
+        WHERE (?1 IS NULL OR branch_id = ?1)
+        GROUP BY rack_no
+    ) a ON a.rack_no = r.name
+    ORDER BY r.ord
+'''
+
+# The dashboard only ever shows the latest items per shelf, so cap each
+# (rack, shelf) partition at 50 rows rather than sorting the entire table
+Q_DASH_ITEMS = '''
+    SELECT rack, shelf,
+           json_group_array(json_object(
+               'id', id, 'batch', batch_no, 'mfg', mfg_date, 'expiry', expiry_date,
+               'flavour', flavour, 'movement', movement, 'timestamp', timestamp
+           )) as items
+    FROM (
+        SELECT * FROM (
+            SELECT
+                id,
+                rack_label as rack,
+                shelf_label as shelf,
+                batch_no, mfg_date, expiry_date, flavour, movement, timestamp,
+                ROW_NUMBER() OVER (PARTITION BY rack_label, shelf_label ORDER BY id DESC) as rn
+            FROM scans
+            WHERE (?1 IS NULL OR branch_id = ?1)
+        )
+        WHERE rn <= 50
+        ORDER BY rack, shelf, id DESC
+    )
+    GROUP BY rack, shelf
+'''
+
+# One fixed activity query per sort option (four canonical texts total).
+# Simple DESC for text dates might not be perfect for DD/MM/YYYY but typically
+# works for standard ISO strings; our date format is inconsistent
+# (DD/MM/YYYY vs YYYY-MM-DD vs random), so this is the standard implementation.
+_ACTIVITY_ORDERS = {
+    'newest': 'ORDER BY id DESC',
+    'oldest': 'ORDER BY id ASC',
+    'expiry-asc': "ORDER BY CASE WHEN expiry_date IS NULL OR expiry_date = '' THEN 1 ELSE 0 END, expiry_date ASC",
+    'expiry-desc': 'ORDER BY expiry_date DESC',
+}
+Q_DASH_ACTIVITY = {
+    sort: f'''
+        SELECT id, timestamp, batch_no as batch, rack_no as rack, shelf_no as shelf, movement, expiry_date
+        FROM scans
+        WHERE (?1 IS NULL OR branch_id = ?1)
+        {order_clause}
+        LIMIT 15
+    '''
+    for sort, order_clause in _ACTIVITY_ORDERS.items()
+}
+
+Q_ANALYTICS_RACKS = '''
+    SELECT
+        rack_no as name,
+        SUM(in_count - out_count) as count
+    FROM scans_summary
+    WHERE (?1 IS NULL OR branch_id = ?1)
+    GROUP BY rack_no
+    ORDER BY name
+'''
+
+# Week bucketing happens in SQL off the normalized expiry_iso column; the
+# inner GROUP BY keeps the original per-date net-quantity > 0 filter before
+# dates are folded into weeks
+Q_EXPIRY_FORECAST = '''
+    SELECT flavour, wk, SUM(qty) as qty
+    FROM (
+        SELECT flavour,
+               CAST((julianday(expiry_iso) - julianday(?2)) / 7 AS INTEGER) + 1 as wk,
+               SUM(CASE WHEN movement = 'IN' THEN 1 ELSE -1 END) as qty
+        FROM scans
+        WHERE expiry_iso >= ?2 AND (?1 IS NULL OR branch_id = ?1)
+        GROUP BY flavour, expiry_iso
+        HAVING qty > 0
+    )
+    WHERE wk BETWEEN 1 AND 20
+    GROUP BY flavour, wk
+'''
+
+Q_EXPIRY_ITEMS = '''
+    SELECT batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no
+    FROM scans
+    WHERE expiry_iso >= ?1 AND expiry_iso < ?2
+      AND movement = 'IN'
+      AND (?3 IS NULL OR branch_id = ?3)
+      AND (?4 = '' OR flavour = ?4)
+    ORDER BY expiry_iso
+'''
+
+Q_ANALYTICS_DAILY = '''
+    SELECT
+        DATE(synced_at) as date,
+        SUM(CASE WHEN movement = 'IN' THEN 1 ELSE 0 END) as in_count,
+        SUM(CASE WHEN movement = 'OUT' THEN 1 ELSE 0 END) as out_count
+    FROM scans
+    WHERE (?1 IS NULL OR branch_id = ?1)
+      AND synced_at >= DATE('now', '-7 days')
+    GROUP BY DATE(synced_at)
+    ORDER BY date ASC
+'''
+
+# One long-lived connection per worker thread: opening SQLite per request
+# (file open + journal setup + schema parse) dominates short-query latency.
+_tls = threading.local()
+_all_connections = []
+_all_connections_lock = threading.Lock()
+
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_tls, 'conn', None)
+    if conn is None:
+        # isolation_level='IMMEDIATE' makes write transactions take the WAL
+        # write lock up front instead of upgrading mid-transaction, which is
+        # where concurrent writers would otherwise hit SQLITE_BUSY
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                               isolation_level='IMMEDIATE',
+                               cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA temp_store=MEMORY;'
+            'PRAGMA cache_size=-65536;'
+            'PRAGMA mmap_size=268435456;'
+            'PRAGMA foreign_keys=ON;'
+        )
+        _tls.conn = conn
+        with _all_connections_lock:
+            _all_connections.append(conn)
+    return conn
+
+def get_db_ro():
+    """Thread-local read-only connection for pure-read endpoints.
+
+    mode=ro lets SQLite skip journal preparation and never contend for the
+    WAL write lock, so readers run fully in parallel with writers.
+    """
+    conn = getattr(_tls, 'conn_ro', None)
+    if conn is None:
+        conn = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True,
+                               check_same_thread=False,
+                               cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(
+            'PRAGMA temp_store=MEMORY;'
+            'PRAGMA cache_size=-65536;'
+            'PRAGMA mmap_size=268435456;'
+        )
+        _tls.conn_ro = conn
+        with _all_connections_lock:
+            _all_connections.append(conn)
     return conn
 
+@atexit.register
+def _close_db_connections():
+    with _all_connections_lock:
+        for conn in _all_connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _all_connections.clear()
+
+# scrypt cost parameters for new password hashes (memory-hard, unlike SHA-256)
+_SCRYPT_N = 16384
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+_SCRYPT_MAXMEM = 64 * 1024 * 1024
+
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with scrypt and a random salt.
+
+    Stored format: 'scrypt$<salt_hex>$<digest_hex>'. Old rows are plain
+    unsalted SHA-256 hex; verify_password handles both.
+    """
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt,
+                            n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P, maxmem=_SCRYPT_MAXMEM)
+    return f'scrypt${salt.hex()}${digest.hex()}'
+
+@lru_cache(maxsize=512)
+def verify_password(stored_hash, password):
+    """Check a password against a stored hash (scrypt or legacy SHA-256).
+
+    Bounded cache on the outcome: repeat logins with the same credentials
+    skip the scrypt work, while brute-force attempts pay full cost.
+    """
+    if stored_hash.startswith('scrypt$'):
+        _, salt_hex, digest_hex = stored_hash.split('$', 2)
+        digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt_hex),
+                                n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P, maxmem=_SCRYPT_MAXMEM)
+        return hmac.compare_digest(digest.hex(), digest_hex)
+    # Legacy unsalted SHA-256 row
+    return hmac.compare_digest(stored_hash, hashlib.sha256(password.encode()).hexdigest())
 
 def init_db():
-    """Initialize database with branches, users, and scans tables"""
-    conn = get_db()
+    """Initialize database with branches, users, and scans tables.
+
+    Runs on its own short-lived connection rather than the thread-local
+    pool: with preload_app, init happens in the gunicorn master before
+    fork(), and SQLite connections must not be carried across fork().
+    """
+    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    # WAL is persistent in the file; establish it here so even the first
+    # boot's schema work runs under it before any pooled connection opens
+    cursor.execute('PRAGMA journal_mode=WAL')
     
     # Create branches table
     cursor.execute('''
@@ -102,7 +514,11 @@ def init_db():
             movement TEXT DEFAULT 'IN',
             synced_by TEXT,
             branch_id INTEGER REFERENCES branches(id),
-            synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            client_uuid TEXT,
+            expiry_iso TEXT,
+            synced_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            rack_label TEXT GENERATED ALWAYS AS (CASE WHEN rack_no IS NULL OR rack_no = '' THEN 'Unassigned' ELSE rack_no END) VIRTUAL,
+            shelf_label TEXT GENERATED ALWAYS AS (CASE WHEN shelf_no IS NULL OR shelf_no = '' THEN 'No Shelf' ELSE shelf_no END) VIRTUAL
         )
     ''')
 
@@ -139,7 +555,118 @@ def init_db():
         cursor.execute('ALTER TABLE scans ADD COLUMN synced_by TEXT')
     except:
         pass
-    
+    try:
+        cursor.execute('ALTER TABLE scans ADD COLUMN client_uuid TEXT')
+    except:
+        pass
+    try:
+        cursor.execute('ALTER TABLE scans ADD COLUMN expiry_iso TEXT')
+    except:
+        pass
+    try:
+        cursor.execute("ALTER TABLE scans ADD COLUMN rack_label TEXT GENERATED ALWAYS AS (CASE WHEN rack_no IS NULL OR rack_no = '' THEN 'Unassigned' ELSE rack_no END) VIRTUAL")
+    except:
+        pass
+    try:
+        cursor.execute("ALTER TABLE scans ADD COLUMN shelf_label TEXT GENERATED ALWAYS AS (CASE WHEN shelf_no IS NULL OR shelf_no = '' THEN 'No Shelf' ELSE shelf_no END) VIRTUAL")
+    except:
+        pass
+
+    # Indexes for the hot paths: dashboard rack/movement group-bys,
+    # the login lookup, and the 7-day analytics window
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_rack_mov ON scans(rack_no, movement)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_rack_label ON scans(rack_label)')
+    # Login looks up by username alone, which the column's UNIQUE autoindex
+    # already covers; drop the old three-column login index that kept a
+    # second copy of every password hash and churned on rehash-on-login
+    cursor.execute('DROP INDEX IF EXISTS idx_users_login')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_synced_at ON scans(synced_at)')
+    # Branch-filtered variants of the dashboard/analytics queries
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_branch_movement ON scans(branch_id, movement)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_branch_synced ON scans(branch_id, synced_at)')
+    # Expiry forecast only ever looks at rows that actually carry a date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scans_branch_expiry ON scans(branch_id, expiry_date) WHERE expiry_date IS NOT NULL AND expiry_date != ''")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_expiry_iso ON scans(expiry_iso) WHERE expiry_iso IS NOT NULL')
+    # Idempotency key for /api/sync retries: a re-sent scan with the same
+    # client uuid is silently ignored by INSERT OR IGNORE
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_scans_client_uuid ON scans(client_uuid) WHERE client_uuid IS NOT NULL')
+    # Pending-approval lookups: only the handful of active=0 rows are indexed
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_pending ON users(active) WHERE active = 0')
+    # Covering index for the sync duplicate-key prefetch: the whole natural
+    # key comes off the index with no row lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_dup ON scans(batch_no, mfg_date, expiry_date, rack_no, shelf_no, movement)')
+    # OUT-scan stock validation probes this exact six-column location key
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_stock_loc ON scans(batch_no, flavour, mfg_date, expiry_date, rack_no, shelf_no)')
+    # Transfer endpoints filter by flavour + movement and sort by expiry
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scans_flavour_movement ON scans(flavour, movement, expiry_iso)')
+    # OUT scans complete transfer requests matched on this exact key
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tr_match ON transfer_requests(batch_no, flavour, rack_no, shelf_no, status)')
+
+    # Materialized per-branch/per-rack movement counts, kept current by the
+    # triggers below so rack stats read a few dozen summary rows no matter
+    # how large scans grows. branch_id 0 stands in for NULL rows so the
+    # upsert key always conflicts properly.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scans_summary (
+            branch_id INTEGER NOT NULL,
+            rack_no TEXT NOT NULL,
+            in_count INTEGER DEFAULT 0,
+            out_count INTEGER DEFAULT 0,
+            PRIMARY KEY (branch_id, rack_no)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS scans_summary_ai AFTER INSERT ON scans BEGIN
+            INSERT INTO scans_summary (branch_id, rack_no, in_count, out_count)
+            VALUES (COALESCE(NEW.branch_id, 0),
+                    COALESCE(NULLIF(NEW.rack_no, ''), 'Unassigned'),
+                    NEW.movement = 'IN', NEW.movement = 'OUT')
+            ON CONFLICT(branch_id, rack_no) DO UPDATE SET
+                in_count = in_count + excluded.in_count,
+                out_count = out_count + excluded.out_count;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS scans_summary_ad AFTER DELETE ON scans BEGIN
+            UPDATE scans_summary SET
+                in_count = in_count - (OLD.movement = 'IN'),
+                out_count = out_count - (OLD.movement = 'OUT')
+            WHERE branch_id = COALESCE(OLD.branch_id, 0)
+              AND rack_no = COALESCE(NULLIF(OLD.rack_no, ''), 'Unassigned');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS scans_summary_au AFTER UPDATE OF branch_id, rack_no, movement ON scans BEGIN
+            UPDATE scans_summary SET
+                in_count = in_count - (OLD.movement = 'IN'),
+                out_count = out_count - (OLD.movement = 'OUT')
+            WHERE branch_id = COALESCE(OLD.branch_id, 0)
+              AND rack_no = COALESCE(NULLIF(OLD.rack_no, ''), 'Unassigned');
+            INSERT INTO scans_summary (branch_id, rack_no, in_count, out_count)
+            VALUES (COALESCE(NEW.branch_id, 0),
+                    COALESCE(NULLIF(NEW.rack_no, ''), 'Unassigned'),
+                    NEW.movement = 'IN', NEW.movement = 'OUT')
+            ON CONFLICT(branch_id, rack_no) DO UPDATE SET
+                in_count = in_count + excluded.in_count,
+                out_count = out_count + excluded.out_count;
+        END
+    ''')
+
+    # Rebuild the summary from scans on startup so pre-trigger rows (or any
+    # drift) are folded in
+    cursor.execute('DELETE FROM scans_summary')
+    cursor.execute('''
+        INSERT INTO scans_summary (branch_id, rack_no, in_count, out_count)
+        SELECT COALESCE(branch_id, 0), rack_label,
+               SUM(movement = 'IN'), SUM(movement = 'OUT')
+        FROM scans
+        GROUP BY 1, 2
+    ''')
+
+    # Checkpoint the WAL roughly every 1000 pages so it doesn't grow unbounded
+    # between the relaxed-sync commits
+    cursor.execute('PRAGMA wal_autocheckpoint=1000')
+
     # Create default branch if none exists
     cursor.execute('SELECT COUNT(*) FROM branches')
     if cursor.fetchone()[0] == 0:
@@ -173,7 +700,27 @@ def init_db():
     cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'superadmin'")
     if cursor.fetchone()[0] == 0:
         cursor.execute("UPDATE users SET role = 'superadmin', branch_id = NULL WHERE username = 'admin'")
-    
+
+    # Backfill expiry_iso for rows written before the column existed; the
+    # multi-format parse runs once per distinct date string, not per row
+    cursor.execute('''
+        SELECT DISTINCT expiry_date FROM scans
+        WHERE expiry_iso IS NULL AND expiry_date IS NOT NULL AND expiry_date != ''
+    ''')
+    backfill = []
+    for (expiry_str,) in cursor.fetchall():
+        iso = expiry_to_iso(expiry_str)
+        if iso:
+            backfill.append((iso, expiry_str))
+    if backfill:
+        cursor.executemany(
+            'UPDATE scans SET expiry_iso = ? WHERE expiry_date = ? AND expiry_iso IS NULL',
+            backfill
+        )
+
+    # Refresh planner statistics so the indexes above actually get picked
+    cursor.execute('ANALYZE')
+
     conn.commit()
     conn.close()
 
@@ -192,20 +739,34 @@ def login():
     conn = get_db()
     cursor = conn.cursor()
     
-    # Query user with branch info
+    # Query user with branch info (verify the password in Python, not in SQL:
+    # scrypt hashes are salted so there's no single value to compare against)
     cursor.execute('''
-        SELECT u.id, u.username, u.name, u.role, u.active, u.branch_id, b.name as branch_name, b.code as branch_code
+        SELECT u.id, u.username, u.password, u.name, u.role, u.active, u.branch_id, b.name as branch_name, b.code as branch_code
         FROM users u
         LEFT JOIN branches b ON u.branch_id = b.id
-        WHERE u.username = ? AND u.password = ?
-    ''', (username, hash_password(password)))
+        WHERE u.username = ?
+    ''', (username,))
     user = cursor.fetchone()
-    conn.close()
-    
-    if user:
+
+    if user is None:
+        # Burn the same scrypt cost as a real verify so response time
+        # doesn't reveal whether the username exists
+        hashlib.scrypt(password.encode(), salt=b'\x00' * 16,
+                       n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P, maxmem=_SCRYPT_MAXMEM)
+        return jsonify({'success': False, 'error': 'Invalid username or password'}), 401
+
+    if verify_password(user['password'], password):
         if user['active'] == 0:
             return jsonify({'success': False, 'error': 'Account pending admin approval'}), 401
-        
+
+        # Transparently upgrade legacy unsalted SHA-256 rows to scrypt now
+        # that we hold the plaintext — the rolling-rehash migration pattern
+        if not user['password'].startswith('scrypt$'):
+            cursor.execute('UPDATE users SET password = ? WHERE id = ?',
+                           (hash_password(password), user['id']))
+            conn.commit()
+
         # Set session
         session['user_id'] = user['id']
         session['username'] = user['username']
@@ -264,36 +825,30 @@ def register():
     # Check if username exists
     cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
     if cursor.fetchone():
-        conn.close()
         return jsonify({'success': False, 'error': 'Username already taken'}), 400
     
     # Verify branch exists
     cursor.execute('SELECT id FROM branches WHERE id = ?', (branch_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({'success': False, 'error': 'Invalid branch selected'}), 400
     
     # Create user as INACTIVE (pending admin approval)
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    password_hash = hash_password(password)
     cursor.execute('''
         INSERT INTO users (username, password, name, role, branch_id, active)
         VALUES (?, ?, ?, ?, ?, 0)
     ''', (username, password_hash, username.title(), role, branch_id))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True, 'message': 'Account created! Awaiting admin approval.'})
 
 @app.route('/api/branches', methods=['GET'])
 def list_branches():
     """List all branches for registration dropdown"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, code FROM branches ORDER BY name')
-    branches = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify({'branches': branches})
+    if _branches_bytes is None or time.monotonic() - _branches_built >= _RESP_TTL:
+        _rebuild_branches_cache(get_db_ro().cursor())
+    return Response(_branches_bytes, mimetype='application/json')
 
 @app.route('/api/admin/branches', methods=['GET', 'POST'])
 @superadmin_required
@@ -314,10 +869,10 @@ def manage_branches():
             cursor.execute('INSERT INTO branches (name, code) VALUES (?, ?)', (name, code))
             conn.commit()
             branch_id = cursor.lastrowid
-            conn.close()
+            invalidate_json_cache()
+            _rebuild_branches_cache(cursor)
             return jsonify({'success': True, 'id': branch_id})
         except:
-            conn.close()
             return jsonify({'success': False, 'error': 'Branch code already exists'}), 400
     
     # GET - list all with stats
@@ -328,14 +883,13 @@ def manage_branches():
         FROM branches b ORDER BY b.name
     ''')
     branches = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return jsonify({'branches': branches})
 
 @app.route('/api/users', methods=['GET'])
 @admin_required
 def list_users():
     """Admin only: list users with branch info (filtered by branch for admins)"""
-    conn = get_db()
+    conn = get_db_ro()
     cursor = conn.cursor()
     
     # Superadmin sees all users, admin sees only their branch
@@ -354,19 +908,16 @@ def list_users():
             WHERE u.branch_id = ?
         ''', (branch_id,))
     
-    users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify({'users': users})
+    return jout({'users': cursor.fetchall()})
 
 @app.route('/api/admin/users/pending', methods=['GET'])
 @admin_required
 def pending_users():
     """Get pending (unverified) users"""
-    conn = get_db()
+    conn = get_db_ro()
     cursor = conn.cursor()
     cursor.execute('SELECT id, username, name, role FROM users WHERE active = 0')
     users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return jsonify({'users': users})
 
 @app.route('/api/admin/users/approve', methods=['POST'])
@@ -383,8 +934,8 @@ def approve_user():
     cursor = conn.cursor()
     cursor.execute('UPDATE users SET active = 1 WHERE id = ?', (user_id,))
     conn.commit()
-    conn.close()
-    
+    invalidate_user_cache()
+
     return jsonify({'success': True})
 
 @app.route('/api/admin/users/reject', methods=['POST'])
@@ -401,8 +952,8 @@ def reject_user():
     cursor = conn.cursor()
     cursor.execute('DELETE FROM users WHERE id = ? AND active = 0', (user_id,))
     conn.commit()
-    conn.close()
-    
+    invalidate_user_cache()
+
     return jsonify({'success': True})
 
 @app.route('/api/admin/users/change-password', methods=['POST'])
@@ -427,207 +978,122 @@ def change_user_password():
         cursor.execute('SELECT branch_id FROM users WHERE id = ?', (user_id,))
         target_user = cursor.fetchone()
         if not target_user or target_user['branch_id'] != session.get('branch_id'):
-            conn.close()
             return jsonify({'success': False, 'error': 'You can only change passwords for users in your branch'}), 403
     
     cursor.execute('UPDATE users SET password = ? WHERE id = ?', (hash_password(new_password), user_id))
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
 @app.route('/api/admin/dashboard', methods=['GET'])
 @admin_required
 def admin_dashboard():
-    """Get dashboard data for admin (filtered by branch)"""
+    """Get dashboard data for admin (filtered by branch).
+
+    ?include=stats,racks,items,activity picks which blocks to compute; the
+    default keeps the full payload so existing callers are unchanged, but
+    stat-card polls can ask for just stats,racks,activity and skip the
+    rack_items build entirely.
+    """
     branch_id = request.args.get('branch_id', type=int)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    branch_where = ''
-    branch_params = ()
-    if branch_id:
-        branch_where = ' WHERE branch_id = ?'
-        branch_params = (branch_id,)
-    
-    # Create scans table if not exists (for synced data)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            batch_no TEXT,
-            mfg_date TEXT,
-            expiry_date TEXT,
-            flavour TEXT,
-            rack_no TEXT,
-            shelf_no TEXT,
-            movement TEXT DEFAULT 'IN',
-            branch_id INTEGER,
-            synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    
-    # Get stats (filtered by branch)
-    cursor.execute(f'SELECT COUNT(*) FROM scans{branch_where}', branch_params)
-    total = cursor.fetchone()[0]
-    
-    cursor.execute(f"SELECT COUNT(*) FROM scans{branch_where}{' AND' if branch_where else ' WHERE'} movement = 'IN'", branch_params)
-    total_in = cursor.fetchone()[0]
-    
-    cursor.execute(f"SELECT COUNT(*) FROM scans{branch_where}{' AND' if branch_where else ' WHERE'} movement = 'OUT'", branch_params)
-    total_out = cursor.fetchone()[0]
-    
-    # Current stock = IN - OUT (minimum 0)
-    current_stock = max(0, total_in - total_out)
-    
-    # Get rack summary with net stock (filtered by branch)
-    rack_query = f'''
-        SELECT 
-            CASE WHEN rack_no IS NULL OR rack_no = '' THEN 'Unassigned' ELSE rack_no END as name, 
-            SUM(CASE WHEN movement = 'IN' THEN 1 ELSE 0 END) as in_count,
-            SUM(CASE WHEN movement = 'OUT' THEN 1 ELSE 0 END) as out_count,
-            SUM(CASE WHEN movement = 'IN' THEN 1 ELSE -1 END) as count
-        FROM scans{branch_where}
-        GROUP BY CASE WHEN rack_no IS NULL OR rack_no = '' THEN 'Unassigned' ELSE rack_no END
-        ORDER BY name
-    '''
-    cursor.execute(rack_query, branch_params)
-    rack_data = {row['name']: dict(row) for row in cursor.fetchall()}
-    
-    # Define all racks (1-10)
-    all_rack_names = ['Rack 1', 'Rack 2', 'Rack 3', 'Rack 4', 'Rack 5', 
-                      'Rack 6', 'Rack 7', 'Rack 8', 'Rack 9', 'Rack 10']
-    
-    # Build racks list with defaults for empty racks
-    racks = []
-    for rack_name in all_rack_names:
-        if rack_name in rack_data:
-            rack = rack_data[rack_name]
-            rack['count'] = max(0, rack['count'])  # Ensure not negative
-            racks.append(rack)
-        else:
-            racks.append({'name': rack_name, 'count': 0, 'in_count': 0, 'out_count': 0})
-    
-    # Get detailed items per rack (filtered by branch)
-    items_query = f'''
-        SELECT 
-            id,
-            CASE WHEN rack_no IS NULL OR rack_no = '' THEN 'Unassigned' ELSE rack_no END as rack,
-            CASE WHEN shelf_no IS NULL OR shelf_no = '' THEN 'No Shelf' ELSE shelf_no END as shelf,
-            batch_no, mfg_date, expiry_date, flavour, movement, timestamp
-        FROM scans{branch_where}
-        ORDER BY rack, shelf, id DESC
-    '''
-    cursor.execute(items_query, branch_params)
-    
-    # Group items by rack -> shelf
-    rack_items = {}
-    for row in cursor.fetchall():
-        rack_name = row['rack']
-        shelf_name = row['shelf']
-        
-        if rack_name not in rack_items:
-            rack_items[rack_name] = {}
-        if shelf_name not in rack_items[rack_name]:
-            rack_items[rack_name][shelf_name] = []
-        
-        rack_items[rack_name][shelf_name].append({
-            'id': row['id'],
-            'batch': row['batch_no'],
-            'mfg': row['mfg_date'],
-            'expiry': row['expiry_date'],
-            'flavour': row['flavour'],
-            'movement': row['movement'],
-            'timestamp': row['timestamp']
-        })
-    
-    # Add default shelves A-E for each rack
-    default_shelves = ['Shelf A', 'Shelf B', 'Shelf C', 'Shelf D', 'Shelf E']
-    for rack_name in all_rack_names:
-        if rack_name not in rack_items:
-            rack_items[rack_name] = {}
-        for shelf in default_shelves:
-            if shelf not in rack_items[rack_name]:
-                rack_items[rack_name][shelf] = []
-    
-    # Sort logic for recent activity
     sort_type = request.args.get('sort', 'newest')
-    
-    order_clause = 'ORDER BY id DESC'
-    if sort_type == 'oldest':
-        order_clause = 'ORDER BY id ASC'
-    elif sort_type == 'expiry-asc':
-        order_clause = "ORDER BY CASE WHEN expiry_date IS NULL OR expiry_date = '' THEN 1 ELSE 0 END, expiry_date ASC"
-    elif sort_type == 'expiry-desc':
-        # Simple DESC for text dates might not be perfect for DD/MM/YYYY but typically works for standard ISO strings.
-        # However, our date format is inconsistent (DD/MM/YYYY vs YYYY-MM-DD vs random). 
-        # Standard implementation for now:
-        order_clause = "ORDER BY expiry_date DESC"
-
-    # Get recent activity (last 15, filtered by branch)
-    activity_query = f'''
-        SELECT id, timestamp, batch_no as batch, rack_no as rack, shelf_no as shelf, movement, expiry_date 
-        FROM scans{branch_where}
-        {order_clause}
-        LIMIT 15
-    '''
-    cursor.execute(activity_query, branch_params)
-    activity = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    
-    return jsonify({
-        'stats': {
+    if sort_type not in Q_DASH_ACTIVITY:
+        sort_type = 'newest'
+    include_arg = request.args.get('include', 'stats,racks,items,activity')
+    # Unknown block names drop out here, so the cache only ever keys on the
+    # validated values rather than whatever strings the client sent
+    include = {'stats', 'racks', 'items', 'activity'} & set(include_arg.split(','))
+
+    cache_key = ('dashboard', branch_id, sort_type, tuple(sorted(include)))
+    cached = cached_json(cache_key)
+    if cached is not None:
+        return cached
+
+    conn = get_db_ro()
+    cursor = conn.cursor()
+
+    branch_params = (branch_id,)
+    payload = {}
+
+    if 'stats' in include:
+        # Get stats in one pass over the table instead of three separate COUNTs
+        cursor.execute(Q_DASH_STATS, branch_params)
+        total, total_in, total_out = cursor.fetchone()
+        total_in = total_in or 0
+        total_out = total_out or 0
+
+        payload['stats'] = {
             'total': total,
             'in': total_in,
             'out': total_out,
-            'current': current_stock
-        },
-        'racks': racks,
-        'rack_items': rack_items,
-        'activity': activity
-    })
+            # Current stock = IN - OUT (minimum 0)
+            'current': max(0, total_in - total_out)
+        }
+
+    # Define all racks (1-10)
+    all_rack_names = ['Rack 1', 'Rack 2', 'Rack 3', 'Rack 4', 'Rack 5',
+                      'Rack 6', 'Rack 7', 'Rack 8', 'Rack 9', 'Rack 10']
+
+    if 'racks' in include:
+        # Rack summary with net stock (filtered by branch); the query itself
+        # fills in zero rows for empty racks in display order
+        cursor.execute(Q_DASH_RACKS, branch_params)
+        payload['racks'] = cursor.fetchall()
+
+    if 'items' in include:
+        # Get detailed items per rack (filtered by branch), letting SQLite build
+        # the per-shelf item arrays as JSON instead of dict-churning per row in Python
+        cursor.execute(Q_DASH_ITEMS, branch_params)
+
+        # Group items by rack -> shelf
+        rack_items = {}
+        for row in cursor.fetchall():
+            rack_items.setdefault(row['rack'], {})[row['shelf']] = orjson.loads(row['items'])
+
+        # Add default shelves A-E for each rack
+        default_shelves = ['Shelf A', 'Shelf B', 'Shelf C', 'Shelf D', 'Shelf E']
+        for rack_name in all_rack_names:
+            if rack_name not in rack_items:
+                rack_items[rack_name] = {}
+            for shelf in default_shelves:
+                if shelf not in rack_items[rack_name]:
+                    rack_items[rack_name][shelf] = []
+        payload['rack_items'] = rack_items
+
+    if 'activity' in include:
+        # Get recent activity (last 15, filtered by branch, sort from query arg)
+        # Rows go to orjson as-is (jout's default hook handles sqlite3.Row), so
+        # there's no need to materialize a dict per row here
+        cursor.execute(Q_DASH_ACTIVITY[sort_type], branch_params)
+        payload['activity'] = cursor.fetchall()
+
+    return cache_json(cache_key, jout(payload))
 
 @app.route('/api/admin/analytics')
 @admin_required
 def get_analytics():
     """Get analytics data for charts (filtered by branch)"""
     branch_id = request.args.get('branch_id', type=int)
-    
-    conn = get_db()
+
+    cached = cached_json(('analytics', branch_id))
+    if cached is not None:
+        return cached
+
+    conn = get_db_ro()
     cursor = conn.cursor()
-    
-    # Build WHERE clause for branch filtering
-    branch_where = ''
-    branch_params = ()
-    if branch_id:
-        branch_where = ' WHERE branch_id = ?'
-        branch_params = (branch_id,)
-    
-    # Basic stats
-    cursor.execute(f'SELECT COUNT(*) as total FROM scans{branch_where}', branch_params)
-    total = cursor.fetchone()['total']
-    
-    cursor.execute(f"SELECT COUNT(*) as count FROM scans{branch_where}{' AND' if branch_where else ' WHERE'} movement = 'IN'", branch_params)
-    total_in = cursor.fetchone()['count']
-    
-    cursor.execute(f"SELECT COUNT(*) as count FROM scans{branch_where}{' AND' if branch_where else ' WHERE'} movement = 'OUT'", branch_params)
-    total_out = cursor.fetchone()['count']
-    
+
+    branch_params = (branch_id,)
+
+    # Basic stats in one pass over the table instead of three separate COUNTs
+    cursor.execute(Q_DASH_STATS, branch_params)
+    total, total_in, total_out = cursor.fetchone()
+    total_in = total_in or 0
+    total_out = total_out or 0
+
     current_stock = max(0, total_in - total_out)
-    
+
     # Rack distribution
-    rack_query = f'''
-        SELECT 
-            CASE WHEN rack_no IS NULL OR rack_no = '' THEN 'Unassigned' ELSE rack_no END as name,
-            SUM(CASE WHEN movement = 'IN' THEN 1 ELSE -1 END) as count
-        FROM scans{branch_where}
-        GROUP BY CASE WHEN rack_no IS NULL OR rack_no = '' THEN 'Unassigned' ELSE rack_no END
-        ORDER BY name
-    '''
-    cursor.execute(rack_query, branch_params)
+    cursor.execute(Q_ANALYTICS_RACKS, branch_params)
     racks_raw = cursor.fetchall()
     racks = [{'name': r['name'], 'count': max(0, r['count'])} for r in racks_raw]
     
@@ -635,16 +1101,7 @@ def get_analytics():
     active_racks = len([r for r in racks if r['count'] > 0])
     
     # Daily activity (last 7 days)
-    daily_query = f'''
-        SELECT 
-            DATE(synced_at) as date,
-            SUM(CASE WHEN movement = 'IN' THEN 1 ELSE 0 END) as in_count,
-            SUM(CASE WHEN movement = 'OUT' THEN 1 ELSE 0 END) as out_count
-        FROM scans{branch_where}{' AND' if branch_where else ' WHERE'} synced_at >= DATE('now', '-7 days')
-        GROUP BY DATE(synced_at)
-        ORDER BY date ASC
-    '''
-    cursor.execute(daily_query, branch_params)
+    cursor.execute(Q_ANALYTICS_DAILY, branch_params)
     daily_raw = cursor.fetchall()
     
     # Format daily data
@@ -654,9 +1111,8 @@ def get_analytics():
     if not daily:
         daily = [{'date': 'Today', 'in_count': total_in, 'out_count': total_out}]
     
-    conn.close()
     
-    return jsonify({
+    return cache_json(('analytics', branch_id), jout({
         'stats': {
             'total': total,
             'in': total_in,
@@ -666,7 +1122,7 @@ def get_analytics():
         },
         'racks': racks,
         'daily': daily
-    })
+    }))
 
 @app.route('/api/admin/expiry-forecast')
 @admin_required
@@ -674,70 +1130,25 @@ def get_expiry_forecast():
     """Get expiry forecast data - items expiring by flavor across 10 weeks"""
     branch_id = request.args.get('branch_id', type=int)
     
-    conn = get_db()
+    conn = get_db_ro()
     cursor = conn.cursor()
-    
-    from datetime import datetime, timedelta
-    
-    today = datetime.now().date()
-    
-    # Get all flavors and their items with expiry dates
-    branch_filter = ''
-    params = []
-    if branch_id:
-        branch_filter = ' AND branch_id = ?'
-        params.append(branch_id)
-    
-    # Query to get all items with expiry dates
-    cursor.execute(f'''
-        SELECT flavour, expiry_date, 
-               SUM(CASE WHEN movement = 'IN' THEN 1 ELSE -1 END) as qty
-        FROM scans
-        WHERE expiry_date IS NOT NULL AND expiry_date != '' {branch_filter}
-        GROUP BY flavour, expiry_date
-        HAVING qty > 0
-    ''', params)
-    
-    items = cursor.fetchall()
-    conn.close()
-    
-    # Parse expiry dates and group by week and flavor
+
+    # Week bucketing and date filtering happen in SQL against the
+    # normalized expiry_iso column; Python just fills the chart structure.
+    # The reference date is the server's local today — the same origin the
+    # expiry-items drill-down uses — so chart and item list agree on which
+    # week a date falls in regardless of the UTC offset.
+    cursor.execute(Q_EXPIRY_FORECAST, (branch_id, datetime.now().date().isoformat()))
+
     flavors = set()
     week_data = {i: {} for i in range(1, 21)}  # Weeks 1-20
-    
-    for item in items:
-        flavor = item['flavour'] or 'Unknown'
-        expiry_str = item['expiry_date']
-        qty = item['qty']
-        
+
+    for row in cursor.fetchall():
+        flavor = row['flavour'] or 'Unknown'
         flavors.add(flavor)
-        
-        # Parse date (try multiple formats including 2-digit year)
-        expiry_date = None
-        for fmt in ['%d/%m/%y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y', '%m/%d/%y']:
-            try:
-                expiry_date = datetime.strptime(expiry_str, fmt).date()
-                break
-            except:
-                continue
-        
-        if not expiry_date:
-            continue
-        
-        # Calculate weeks from today
-        days_until_expiry = (expiry_date - today).days
-        if days_until_expiry < 0:
-            continue  # Already expired
-        
-        week_num = (days_until_expiry // 7) + 1
-        if week_num > 20:
-            continue  # Beyond 20 weeks
-        
-        # Add to week data
-        if flavor not in week_data[week_num]:
-            week_data[week_num][flavor] = 0
-        week_data[week_num][flavor] += qty
-    
+        bucket = week_data[row['wk']]
+        bucket[flavor] = bucket.get(flavor, 0) + row['qty']
+
     # Format response
     flavor_list = sorted(list(flavors))
     
@@ -756,11 +1167,12 @@ def get_expiry_forecast():
             'backgroundColor': colors[idx % len(colors)]
         })
     
-    # Calculate expiry stats
-    expiring_week = sum(sum(week_data[1].values()) if week_data[1] else 0 for _ in [1])
-    expiring_2weeks = sum(sum(week_data[w].values()) for w in range(1, 3) if week_data[w])
-    expiring_month = sum(sum(week_data[w].values()) for w in range(1, 5) if week_data[w])  # ~4 weeks = 30 days
-    
+    # Calculate expiry stats: total each week once, then slice cumulatively
+    week_totals = [sum(week_data[w].values()) for w in range(1, 21)]
+    expiring_week = week_totals[0]
+    expiring_2weeks = sum(week_totals[:2])
+    expiring_month = sum(week_totals[:4])  # ~4 weeks = 30 days
+
     return jsonify({
         'success': True,
         'labels': [f'Week {i}' for i in range(1, 21)],
@@ -783,73 +1195,26 @@ def get_expiry_items():
     if not week:
         return jsonify({'success': False, 'error': 'Week is required'}), 400
     
-    conn = get_db()
+    conn = get_db_ro()
     cursor = conn.cursor()
-    
-    from datetime import datetime, timedelta
-    
+
     today = datetime.now().date()
-    
-    # Calculate date range for the week
+
+    # The requested week as a date range on the normalized expiry_iso column
     week_start = today + timedelta(days=(week - 1) * 7)
     week_end = today + timedelta(days=week * 7)
-    
-    # Get all items with expiry dates
-    branch_filter = ''
-    params = []
-    if branch_id:
-        branch_filter = ' AND branch_id = ?'
-        params.append(branch_id)
-    
-    cursor.execute(f'''
-        SELECT batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no
-        FROM scans
-        WHERE expiry_date IS NOT NULL AND expiry_date != '' {branch_filter}
-        AND movement = 'IN'
-        ORDER BY expiry_date
-    ''', params)
-    
-    items_raw = cursor.fetchall()
-    conn.close()
-    
-    # Filter by week and optionally by flavor
-    items = []
-    for item in items_raw:
-        expiry_str = item['expiry_date']
-        
-        # Parse date
-        expiry_date = None
-        for fmt in ['%d/%m/%y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y', '%m/%d/%y']:
-            try:
-                expiry_date = datetime.strptime(expiry_str, fmt).date()
-                break
-            except:
-                continue
-        
-        if not expiry_date:
-            continue
-        
-        # Check if in the requested week
-        days_until_expiry = (expiry_date - today).days
-        if days_until_expiry < 0:
-            continue
-        
-        item_week = (days_until_expiry // 7) + 1
-        if item_week != week:
-            continue
-        
-        # Filter by flavor if specified
-        if flavor and item['flavour'] != flavor:
-            continue
-        
-        items.append({
-            'batch_no': item['batch_no'] or '-',
-            'mfg_date': item['mfg_date'] or '-',
-            'expiry_date': item['expiry_date'] or '-',
-            'flavour': item['flavour'] or '-',
-            'rack_no': item['rack_no'] or '-',
-            'shelf_no': item['shelf_no'] or '-'
-        })
+
+    cursor.execute(Q_EXPIRY_ITEMS,
+                   (week_start.isoformat(), week_end.isoformat(), branch_id, flavor))
+
+    items = [{
+        'batch_no': item['batch_no'] or '-',
+        'mfg_date': item['mfg_date'] or '-',
+        'expiry_date': item['expiry_date'] or '-',
+        'flavour': item['flavour'] or '-',
+        'rack_no': item['rack_no'] or '-',
+        'shelf_no': item['shelf_no'] or '-'
+    } for item in cursor.fetchall()]
     
     return jsonify({
         'success': True,
@@ -866,14 +1231,16 @@ def sync_user_scans():
     scans = data.get('scans', [])
     user = data.get('user', 'Unknown')
     branch_id = data.get('branch_id')  # Get branch from request
-    
+
+    if not isinstance(scans, list):
+        return jsonify({'success': False, 'error': 'Invalid scans payload'}), 400
+
     # If branch_id is None (e.g. Super Admin), default to 1 (Main Branch)
     if not branch_id:
         conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM branches ORDER BY id LIMIT 1')
         row = cursor.fetchone()
-        conn.close()
         branch_id = row[0] if row else 1
     
     if not scans:
@@ -881,109 +1248,111 @@ def sync_user_scans():
     
     conn = get_db()
     cursor = conn.cursor()
-    
-    # Create table if not exists
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            batch_no TEXT,
-            mfg_date TEXT,
-            expiry_date TEXT,
-            flavour TEXT,
-            rack_no TEXT,
-            shelf_no TEXT,
-            movement TEXT DEFAULT 'IN',
-            synced_by TEXT,
-            branch_id INTEGER,
-            synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Add new scans with branch_id (avoiding duplicates)
-    synced = 0
+
+    # Validate everything first, then insert the whole batch in one go.
+    # rows: tuples to insert; seen/pending track duplicates and stock deltas
+    # within this payload (earlier scans used to be visible via progressive
+    # inserts, now they're tracked in Python).
+    rows = []
+    out_scans = []
+    pending_stock = {}
+
+    normalized = []
     for scan in scans:
-        # Check if scan already exists (same product at same location with same movement)
-        cursor.execute('''
-            SELECT id FROM scans 
-            WHERE batch_no = ? AND mfg_date = ? AND expiry_date = ? AND rack_no = ? AND shelf_no = ? AND movement = ?
-        ''', (
-            scan.get('batchNo', ''),
-            scan.get('mfgDate', ''),
-            scan.get('expiryDate', ''),
-            scan.get('rackNo', ''),
-            scan.get('shelfNo', ''),
-            scan.get('movement', 'IN')
-        ))
-        
-        if cursor.fetchone():
+        fields = normalize_scan(scan)
+        if fields is None:
+            return jsonify({'success': False, 'error': 'Invalid scan entry'}), 400
+        normalized.append(fields)
+
+    # Probe only the natural keys this payload actually carries — each chunk
+    # is a batch of B-tree descents on the covering idx_scans_dup index, so
+    # duplicate detection costs O(payload) regardless of table size. Keys for
+    # scans accepted from this payload are added to the same set as we go.
+    payload_keys = list({(f[1], f[2], f[3], f[5], f[6], f[7]) for f in normalized})
+    seen = set()
+    for start in range(0, len(payload_keys), 150):
+        chunk = payload_keys[start:start + 150]
+        placeholders = ','.join(['(?,?,?,?,?,?)'] * len(chunk))
+        cursor.execute(f'''
+            SELECT batch_no, mfg_date, expiry_date, rack_no, shelf_no, movement
+            FROM scans
+            WHERE (batch_no, mfg_date, expiry_date, rack_no, shelf_no, movement)
+                  IN (VALUES {placeholders})
+        ''', [value for key in chunk for value in key])
+        seen.update(tuple(row) for row in cursor.fetchall())
+
+    # Stock balances for every location an OUT scan touches, grouped into a
+    # handful of row-value IN queries instead of one aggregate per OUT scan.
+    # 150 keys x 6 columns stays under the 999 bound-parameter limit.
+    out_keys = list({(f[1], f[4], f[2], f[3], f[5], f[6])
+                     for f in normalized if f[7] == 'OUT'})
+    stock = {}
+    for start in range(0, len(out_keys), 150):
+        chunk = out_keys[start:start + 150]
+        placeholders = ','.join(['(?,?,?,?,?,?)'] * len(chunk))
+        cursor.execute(f'''
+            SELECT batch_no, flavour, mfg_date, expiry_date, rack_no, shelf_no,
+                   SUM(CASE WHEN movement = 'IN' THEN 1 ELSE -1 END) AS net
+            FROM scans
+            WHERE (batch_no, flavour, mfg_date, expiry_date, rack_no, shelf_no)
+                  IN (VALUES {placeholders})
+            GROUP BY batch_no, flavour, mfg_date, expiry_date, rack_no, shelf_no
+        ''', [value for key in chunk for value in key])
+        for row in cursor.fetchall():
+            values = tuple(row)
+            stock[values[:6]] = values[6]
+
+    for fields in normalized:
+        (timestamp, batch_no, mfg_date, expiry_date, flavour,
+         rack_no, shelf_no, movement, client_uuid) = fields
+
+        # Same product at same location with same movement, whether already in
+        # the table or earlier in this payload
+        dup_key = (batch_no, mfg_date, expiry_date, rack_no, shelf_no, movement)
+        if dup_key in seen:
             continue # Skip duplicate
 
-        # Validation for OUT scans: Check if stock exists
-        if scan.get('movement') == 'OUT':
-            cursor.execute('''
-                SELECT movement FROM scans 
-                WHERE batch_no = ? AND flavour = ? 
-                AND mfg_date = ? AND expiry_date = ?
-                AND rack_no = ? AND shelf_no = ?
-            ''', (
-                scan.get('batchNo', ''),
-                scan.get('flavour', ''),
-                scan.get('mfgDate', ''),
-                scan.get('expiryDate', ''),
-                scan.get('rackNo', ''),
-                scan.get('shelfNo', '')
-            ))
-            
-            stock_rows = cursor.fetchall()
-            in_count = sum(1 for r in stock_rows if r['movement'] == 'IN')
-            out_count = sum(1 for r in stock_rows if r['movement'] == 'OUT')
-            
-            if in_count <= out_count:
-                conn.close()
+        stock_key = (batch_no, flavour, mfg_date, expiry_date, rack_no, shelf_no)
+
+        # Validation for OUT scans: check against the prefetched balances
+        if movement == 'OUT':
+            if stock.get(stock_key, 0) + pending_stock.get(stock_key, 0) <= 0:
                 return jsonify({
-                    'success': False, 
-                    'error': f"Stock Error: No available stock found for Batch {scan.get('batchNo')} ({scan.get('flavour')}) at this location."
+                    'success': False,
+                    'error': f"Stock Error: No available stock found for Batch {batch_no} ({flavour}) at this location."
                 }), 400
 
+            out_scans.append((batch_no, flavour, rack_no, shelf_no))
+
+        seen.add(dup_key)
+        pending_stock[stock_key] = pending_stock.get(stock_key, 0) + (1 if movement == 'IN' else -1)
+        rows.append((timestamp, batch_no, mfg_date, expiry_date, flavour,
+                     rack_no, shelf_no, movement, user, branch_id, client_uuid,
+                     expiry_to_iso(expiry_date)))
+
+    # One prepared statement, one transaction for the whole batch; rowcount
+    # excludes retried scans dropped by the client_uuid unique index
+    cursor.executemany(SCAN_INSERT_SQL, rows)
+    synced = cursor.rowcount
+
+    # Mark one matching submitted transfer request as completed per OUT scan.
+    # The match-and-update happens in a single statement; the id subquery
+    # keeps the old one-request-per-scan behavior rather than completing
+    # every submitted request at the location at once.
+    for out_key in out_scans:
         cursor.execute('''
-            INSERT INTO scans (timestamp, batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no, movement, synced_by, branch_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            scan.get('timestamp', ''),
-            scan.get('batchNo', ''),
-            scan.get('mfgDate', ''),
-            scan.get('expiryDate', ''),
-            scan.get('flavour', ''),
-            scan.get('rackNo', ''),
-            scan.get('shelfNo', ''),
-            scan.get('movement', 'IN'),
-            user,
-            branch_id
-        ))
-        synced += 1
-        
-        # Check if this is an OUT scan matching a transfer request
-        if scan.get('movement') == 'OUT':
-            # Find matching submitted request
-            cursor.execute('''
-                SELECT id FROM transfer_requests 
+            UPDATE transfer_requests
+            SET status = 'completed', updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM transfer_requests
                 WHERE batch_no = ? AND flavour = ? AND rack_no = ? AND shelf_no = ? AND status = 'submitted'
-            ''', (
-                scan.get('batchNo', ''),
-                scan.get('flavour', ''),
-                scan.get('rackNo', ''),
-                scan.get('shelfNo', '')
-            ))
-            
-            req = cursor.fetchone()
-            if req:
-                # Mark as completed
-                cursor.execute('UPDATE transfer_requests SET status = "completed", updated_at = CURRENT_TIMESTAMP WHERE id = ?', (req['id'],))
-    
+                LIMIT 1
+            )
+        ''', out_key)
+
     conn.commit()
-    conn.close()
-    
+    invalidate_json_cache()
+
     return jsonify({'success': True, 'synced': synced})
 
 @app.route('/api/admin/sync', methods=['POST'])
@@ -995,44 +1364,28 @@ def sync_scans():
     
     conn = get_db()
     cursor = conn.cursor()
-    
-    # Create table if not exists
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            batch_no TEXT,
-            mfg_date TEXT,
-            expiry_date TEXT,
-            flavour TEXT,
-            rack_no TEXT,
-            shelf_no TEXT,
-            movement TEXT DEFAULT 'IN',
-            synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Clear existing and insert new
+
+    # Clear existing and insert new (one transaction, multi-row statements)
     cursor.execute('DELETE FROM scans')
-    
-    for scan in scans:
-        cursor.execute('''
-            INSERT INTO scans (timestamp, batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no, movement)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            scan.get('timestamp', ''),
-            scan.get('batchNo', ''),
-            scan.get('mfgDate', ''),
-            scan.get('expiryDate', ''),
-            scan.get('flavour', ''),
-            scan.get('rackNo', ''),
-            scan.get('shelfNo', ''),
-            scan.get('movement', 'IN')
-        ))
-    
+
+    bulk_insert(cursor, '''
+        INSERT INTO scans (timestamp, batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no, movement, expiry_iso)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        scan.get('timestamp', ''),
+        scan.get('batchNo', ''),
+        scan.get('mfgDate', ''),
+        scan.get('expiryDate', ''),
+        scan.get('flavour', ''),
+        scan.get('rackNo', ''),
+        scan.get('shelfNo', ''),
+        scan.get('movement', 'IN'),
+        expiry_to_iso(scan.get('expiryDate', ''))
+    ) for scan in scans])
+
     conn.commit()
-    conn.close()
-    
+    invalidate_json_cache()
+
     return jsonify({'success': True, 'synced': len(scans)})
 
 @app.route('/api/admin/export', methods=['GET'])
@@ -1058,22 +1411,19 @@ def export_data():
     query += ' ORDER BY s.timestamp DESC'
     
     cursor.execute(query, params)
-    scans = cursor.fetchall()
-    conn.close()
-    
-    # Generate CSV
+
+    # Generate CSV straight off the cursor: rows are fetched lazily, and
+    # ~64KB chunks per yield keep memory flat while minimizing the number of
+    # WSGI chunk boundaries on large exports
     def generate():
         data = io.StringIO()
         w = csv.writer(data)
-        
+
         # Header
         w.writerow(('Timestamp', 'Branch', 'Batch No', 'Mfg Date', 'Expiry Date', 'Flavour', 'Rack', 'Shelf', 'Movement', 'Synced By'))
-        yield data.getvalue()
-        data.seek(0)
-        data.truncate(0)
-        
+
         # Rows
-        for s in scans:
+        for s in cursor:
             w.writerow((
                 s['timestamp'],
                 s['branch_name'] or 'Unknown',
@@ -1086,9 +1436,12 @@ def export_data():
                 s['movement'],
                 s['synced_by']
             ))
+            if data.tell() >= 65536:
+                yield data.getvalue()
+                data.seek(0)
+                data.truncate(0)
+        if data.tell():
             yield data.getvalue()
-            data.seek(0)
-            data.truncate(0)
 
     # Return as streaming response
     response = Response(generate(), mimetype='text/csv')
@@ -1120,10 +1473,10 @@ def update_scan():
         data.get('movement', 'IN'),
         scan_id
     ))
-    
+
     conn.commit()
-    conn.close()
-    
+    invalidate_json_cache()
+
     return jsonify({'success': True})
 
 @app.route('/api/admin/scan/add', methods=['POST'])
@@ -1135,13 +1488,9 @@ def add_scan():
     conn = get_db()
     cursor = conn.cursor()
     
-    from datetime import datetime
     timestamp = datetime.now().strftime('%d/%m/%Y, %I:%M:%S %p')
-    
-    cursor.execute('''
-        INSERT INTO scans (timestamp, batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no, movement, synced_by, branch_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+
+    cursor.execute(SCAN_INSERT_SQL, (
         timestamp,
         data.get('batch_no', ''),
         data.get('mfg_date', ''),
@@ -1151,12 +1500,14 @@ def add_scan():
         data.get('shelf_no', ''),
         data.get('movement', 'IN'),
         data.get('synced_by', 'Admin'),
-        data.get('branch_id')
+        data.get('branch_id'),
+        None,
+        expiry_to_iso(data.get('expiry_date', ''))
     ))
-    
+
     conn.commit()
-    conn.close()
-    
+    invalidate_json_cache()
+
     return jsonify({'success': True})
 
 @app.route('/api/admin/csv/import', methods=['POST'])
@@ -1174,33 +1525,35 @@ def import_csv():
     conn = get_db()
     cursor = conn.cursor()
     
-    from datetime import datetime
     timestamp = datetime.now().strftime('%d/%m/%Y, %I:%M:%S %p')
-    
-    imported = 0
-    for scan in scans:
-        cursor.execute('''
-            INSERT INTO scans (timestamp, batch_no, mfg_date, expiry_date, flavour, rack_no, shelf_no, movement, synced_by, branch_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            timestamp,
-            scan.get('batch_no', ''),
-            scan.get('mfg_date', ''),
-            scan.get('expiry_date', ''),
-            scan.get('flavour', ''),
-            scan.get('rack_no', ''),
-            scan.get('shelf_no', ''),
-            scan.get('movement', 'IN'),
-            synced_by,
-            branch_id
-        ))
-        imported += 1
-    
+
+    rows = [(
+        timestamp,
+        scan.get('batch_no', ''),
+        scan.get('mfg_date', ''),
+        scan.get('expiry_date', ''),
+        scan.get('flavour', ''),
+        scan.get('rack_no', ''),
+        scan.get('shelf_no', ''),
+        scan.get('movement', 'IN'),
+        synced_by,
+        branch_id,
+        None,
+        expiry_to_iso(scan.get('expiry_date', ''))
+    ) for scan in scans]
+
+    bulk_insert(cursor, SCAN_INSERT_SQL, rows)
+    imported = len(rows)
+
     conn.commit()
-    conn.close()
-    
+    invalidate_json_cache()
+
     return jsonify({'success': True, 'imported': imported})
 
+# One keep-alive session to the OCR service: the pooled TLS connection is
+# reused across scans instead of paying a fresh handshake per request
+_ocr_session = requests.Session()
+
 @app.route('/api/ocr', methods=['POST'])
 @login_required
 def proxy_ocr():
@@ -1209,10 +1562,10 @@ def proxy_ocr():
         return jsonify({'error': 'No file provided'}), 400
         
     file = request.files['file']
-    
+
     # OCR.space API Key (Securely stored on server)
     API_KEY = 'K85403682988957'
-    
+
     try:
         payload = {
             'apikey': API_KEY,
@@ -1223,18 +1576,26 @@ def proxy_ocr():
             'detectOrientation': 'true'
         }
         
+        # Hand requests the upload stream itself (a spooled temp file) rather
+        # than reading the whole image into memory first
         files = {
-            'file': (file.filename, file.read(), file.content_type)
+            'file': (file.filename, file.stream, file.content_type)
         }
-        
-        response = requests.post(
+
+        response = _ocr_session.post(
             'https://api.ocr.space/parse/image',
             files=files,
             data=payload,
-            timeout=30
+            timeout=30,
+            stream=True
+        )
+
+        # Relay the OCR JSON as-is instead of decoding and re-encoding it
+        return Response(
+            response.iter_content(8192),
+            status=response.status_code,
+            content_type=response.headers.get('Content-Type', 'application/json')
         )
-        
-        return jsonify(response.json())
     except Exception as e:
         print(f"OCR Proxy Error: {e}")
         return jsonify({'error': 'OCR Service Failed'}), 500
@@ -1253,8 +1614,8 @@ def delete_scan():
     cursor = conn.cursor()
     cursor.execute('DELETE FROM scans WHERE id = ?', (scan_id,))
     conn.commit()
-    conn.close()
-    
+    invalidate_json_cache()
+
     return jsonify({'success': True})
 
 @app.route('/admin')
@@ -1282,8 +1643,16 @@ def serve_branches():
 def serve_users():
     return send_from_directory('.', 'users.html')
 
+# Non-HTML assets change far less often than the page shells, so they get a
+# day of browser cache. Filenames aren't content-hashed, so 'immutable' is
+# deliberately not set: a deploy still revalidates via ETag after expiry.
+_ASSET_SUFFIXES = ('.js', '.css', '.png', '.jpg', '.jpeg', '.svg', '.ico', '.woff', '.woff2')
+_ASSET_MAX_AGE = 86400
+
 @app.route('/<path:path>')
 def serve_static(path):
+    if path.endswith(_ASSET_SUFFIXES):
+        return send_from_directory('.', path, max_age=_ASSET_MAX_AGE)
     return send_from_directory('.', path)
 
 @app.route('/pivot')
@@ -1295,38 +1664,36 @@ def serve_pivot():
 def get_pivot_data():
     """Get flat scan data for pivot dashboard"""
     branch_id = request.args.get('branch_id', type=int)
-    
-    conn = get_db()
+
+    # The pivot join is the most expensive read in the app and every
+    # dashboard refresh re-requests it; scan writes invalidate this cache
+    cached = cached_json(('pivot', branch_id))
+    if cached is not None:
+        return cached
+
+    conn = get_db_ro()
     cursor = conn.cursor()
-    
-    # Base query - match CSV export columns
-    query = '''
-        SELECT s.id, s.timestamp, s.batch_no, s.mfg_date, s.expiry_date, 
-               s.flavour, s.rack_no, s.shelf_no, s.movement, s.branch_id, 
+
+    # Base query - match CSV export columns. The transfer-request match rides
+    # the idx_tr_match index, so the LEFT JOIN is an indexed probe per row.
+    cursor.execute('''
+        SELECT s.id, s.timestamp, s.batch_no, s.mfg_date, s.expiry_date,
+               s.flavour, s.rack_no, s.shelf_no, s.movement, s.branch_id,
                s.synced_by, b.name as branch_name,
                tr.requested_by_name
         FROM scans s
         LEFT JOIN branches b ON s.branch_id = b.id
-        LEFT JOIN transfer_requests tr ON 
-            tr.batch_no = s.batch_no AND 
-            tr.flavour = s.flavour AND 
-            tr.rack_no = s.rack_no AND 
+        LEFT JOIN transfer_requests tr ON
+            tr.batch_no = s.batch_no AND
+            tr.flavour = s.flavour AND
+            tr.rack_no = s.rack_no AND
             tr.shelf_no = s.shelf_no AND
             s.movement = 'OUT'
-    '''
-    params = []
-    
-    if branch_id:
-        query += ' WHERE s.branch_id = ?'
-        params.append(branch_id)
-        
-    query += ' ORDER BY s.timestamp DESC'
-    
-    cursor.execute(query, params)
-    scans = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify({'success': True, 'scans': scans})
+        WHERE (?1 IS NULL OR s.branch_id = ?1)
+        ORDER BY s.timestamp DESC
+    ''', (branch_id or None,))
+
+    return cache_json(('pivot', branch_id), jout({'success': True, 'scans': cursor.fetchall()}))
 
 # --- Transfer Request API ---
 
@@ -1349,15 +1716,20 @@ def get_transfer_flavors():
     # Let's assume we list ALL flavors available in the system or current branch. 
     # Let's use current branch or all if params say so.
     
-    conn = get_db()
+    # The distinct-flavour scan is the same for every caller, so serve it from
+    # the short-TTL response cache; write endpoints already invalidate it
+    cached = cached_json(('transfer_flavors',))
+    if cached is not None:
+        return cached
+
+    conn = get_db_ro()
     cursor = conn.cursor()
-    
+
     # Just get all distinct flavors for now
     cursor.execute("SELECT DISTINCT flavour FROM scans WHERE flavour IS NOT NULL AND flavour != '' ORDER BY flavour")
     flavors = [row['flavour'] for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify({'success': True, 'flavors': flavors})
+
+    return cache_json(('transfer_flavors',), jout({'success': True, 'flavors': flavors}))
 
 @app.route('/api/transfer/nearest-expiry', methods=['GET'])
 @login_required
@@ -1369,79 +1741,27 @@ def get_nearest_expiry():
     if not flavor:
         return jsonify({'success': False, 'error': 'Flavor is required'})
 
-    conn = get_db()
+    conn = get_db_ro()
     cursor = conn.cursor()
-    
-    query = '''
+
+    # expiry_iso is the ISO-normalized expiry kept at insert time, so the
+    # nearest expiry is an indexed ORDER BY ... LIMIT 1 — no fetching every
+    # matching row and date-sorting in Python
+    cursor.execute('''
         SELECT batch_no, expiry_date, mfg_date, rack_no, shelf_no, branch_id
-        FROM scans 
-        WHERE flavour = ? AND movement = 'IN' 
-        AND expiry_date IS NOT NULL AND expiry_date != ''
-    '''
-    params = [flavor]
-    
-    if branch_id:
-        query += ' AND branch_id = ?'
-        params.append(branch_id)
-        
-    # We want the nearest (earliest) expiry date that is presumably 'future' or 'recent'
-    # Actually just ORDER BY expiry_date ASC gives us the oldest/nearest expiry
-    # We might want to filter out expired items? Maybe not, maybe we want to move them to dispose.
-    # User just said "nearest expiry date batch".
-    # Note: Using simple string comparison for dates YYYY-MM-DD works, but if format is DD-MM-YYYY it might fail.
-    # Our data seems to be DD/MM/YYYY or similar. We should try to parse or just trust the DB sort if consistent.
-    # The previous code had complex date parsing. 
-    # For now, let's fetch all IN items for this flavor, parse dates in python, sort, and pick first.
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    if not rows:
+        FROM scans
+        WHERE flavour = ?1 AND movement = 'IN'
+        AND expiry_iso IS NOT NULL
+        AND (?2 IS NULL OR branch_id = ?2)
+        ORDER BY expiry_iso ASC
+        LIMIT 1
+    ''', (flavor, branch_id or None))
+    row = cursor.fetchone()
+
+    if row is None:
         return jsonify({'success': False, 'message': 'No stock found for this flavor'})
 
-    items = []
-    from datetime import datetime
-    today = datetime.now().date()
-    
-    for row in rows:
-        expiry_str = row['expiry_date']
-        try:
-            # Try parsing multiple formats
-            expiry_date = None
-            for fmt in ['%d/%m/%y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y', '%m/%d/%y']:
-                try:
-                    expiry_date = datetime.strptime(expiry_str, fmt).date()
-                    break
-                except:
-                    continue
-            
-            if expiry_date:
-                items.append({
-                    'batch_no': row['batch_no'],
-                    'expiry_date': row['expiry_date'], # Keep original string
-                    'expiry_dt': expiry_date, # For sorting
-                    'mfg_date': row['mfg_date'],
-                    'rack_no': row['rack_no'],
-                    'shelf_no': row['shelf_no'],
-                    'branch_id': row['branch_id']
-                })
-        except:
-            continue
-            
-    if not items:
-         return jsonify({'success': False, 'message': 'No valid expiry dates found'})
-
-    # Sort by expiry date ASC
-    items.sort(key=lambda x: x['expiry_dt'])
-    
-    # Pick the first one (nearest expiry)
-    best_item = items[0]
-    
-    # Remove expiry_dt object before returning
-    del best_item['expiry_dt']
-    
-    return jsonify({'success': True, 'item': best_item})
+    return jout({'success': True, 'item': row})
 
 @app.route('/api/transfer/batches', methods=['GET'])
 @login_required
@@ -1453,68 +1773,25 @@ def get_transfer_batches():
     if not flavor:
         return jsonify({'success': False, 'error': 'Flavor is required'})
 
-    conn = get_db()
+    conn = get_db_ro()
     cursor = conn.cursor()
-    
-    query = '''
+
+    # Sorted on the normalized expiry_iso column server-side; rows whose
+    # expiry never parsed (expiry_iso NULL) sort last rather than dropping
+    cursor.execute('''
         SELECT batch_no, expiry_date, mfg_date, rack_no, shelf_no, branch_id
-        FROM scans 
-        WHERE flavour = ? AND movement = 'IN' 
+        FROM scans
+        WHERE flavour = ?1 AND movement = 'IN'
         AND expiry_date IS NOT NULL AND expiry_date != ''
-    '''
-    params = [flavor]
-    
-    if branch_id:
-        query += ' AND branch_id = ?'
-        params.append(branch_id)
-    
-    cursor.execute(query, params)
+        AND (?2 IS NULL OR branch_id = ?2)
+        ORDER BY expiry_iso IS NULL, expiry_iso ASC
+    ''', (flavor, branch_id or None))
     rows = cursor.fetchall()
-    conn.close()
-    
+
     if not rows:
         return jsonify({'success': False, 'items': []})
 
-    items = []
-    from datetime import datetime
-    
-    for row in rows:
-        expiry_str = row['expiry_date']
-        try:
-            # Try parsing multiple formats
-            expiry_date = None
-            for fmt in ['%d/%m/%y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%m/%d/%Y', '%m/%d/%y']:
-                try:
-                    expiry_date = datetime.strptime(expiry_str, fmt).date()
-                    break
-                except:
-                    continue
-            
-            # If date parse failed, use a far future or past date? Or just exclude?
-            # Let's include it but sort it last if unknown
-            if not expiry_date:
-                 expiry_date = datetime.max.date()
-
-            items.append({
-                'batch_no': row['batch_no'],
-                'expiry_date': row['expiry_date'],
-                'expiry_dt': expiry_date,
-                'mfg_date': row['mfg_date'],
-                'rack_no': row['rack_no'],
-                'shelf_no': row['shelf_no'],
-                'branch_id': row['branch_id']
-            })
-        except:
-             continue
-            
-    # Sort by expiry date ASC
-    items.sort(key=lambda x: x['expiry_dt'])
-    
-    # Cleanup helper key
-    for item in items:
-        del item['expiry_dt']
-    
-    return jsonify({'success': True, 'items': items})
+    return jout({'success': True, 'items': rows})
 
 @app.route('/api/transfer/request', methods=['POST'])
 @login_required
@@ -1537,15 +1814,8 @@ def create_transfer_request():
     
     user_id = session.get('user_id')
     
-    # Get user name
-    cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-    user_row = cursor.fetchone()
-    username = user_row['username'] if user_row else 'Unknown'
-    
-    # Get user's branch
-    cursor.execute('SELECT branch_id FROM users WHERE id = ?', (user_id,))
-    branch_row = cursor.fetchone()
-    branch_id = branch_row['branch_id'] if branch_row else None
+    # Resolve requester name and branch from the in-process user cache
+    username, branch_id = get_user_info(cursor, user_id)
 
     cursor.execute('''
         INSERT INTO transfer_requests 
@@ -1554,7 +1824,6 @@ def create_transfer_request():
     ''', (flavour, batch_no, expiry_date, rack_no, shelf_no, user_id, username, notes, branch_id))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True, 'message': 'Transfer request submitted successfully'})
 
@@ -1586,7 +1855,6 @@ def get_transfer_requests():
     cursor = conn.cursor()
     cursor.execute(query, params)
     requests = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     
     return jsonify({'success': True, 'requests': requests})
 
@@ -1608,13 +1876,12 @@ def update_transfer_status():
                    (new_status, request_id))
     
     conn.commit()
-    conn.close()
     
     return jsonify({'success': True})
 
 if __name__ == '__main__':
-    init_db()
+    # Local development only — production runs under gunicorn (see gunicorn_conf.py)
     print('\n🚀 Label Scanner Server running at http://localhost:5000')
     print('   Login page: http://localhost:5000/')
     print('   Main app:   http://localhost:5000/app\n')
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -0,0 +1,14 @@
+"""
+WSGI entrypoint for production servers (gunicorn / PythonAnywhere).
+
+Run with:
+    gunicorn -c gunicorn_conf.py wsgi:app
+"""
+
+from server import app
+
+# init_db() already runs when server is imported, so each worker has a
+# ready schema by the time it accepts requests.
+
+if __name__ == '__main__':
+    app.run()